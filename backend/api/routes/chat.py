@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-from services.ollama_service import ollama_service
+from services.llm_pool import llm_pool, PoolSaturatedError, NoHealthyBackendError
+from services.llm_scheduler import llm_scheduler, RateLimitedError
+from services.llm_hedge import hedged_llm
 from services.tax_engine import tax_engine
+from services.context_builder import context_builder
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,6 +25,9 @@ class ChatResponse(BaseModel):
 # In-memory conversation storage (replace with Supabase in production)
 conversations = {}
 
+# Chat goes through the hedged service when LLM_HEDGE_ENABLED is set
+chat_llm = hedged_llm or llm_pool
+
 @router.post("/", response_model=ChatResponse)
 async def send_message(chat_message: ChatMessage):
     """Send a message to the tax assistant and get a response"""
@@ -45,16 +51,10 @@ async def send_message(chat_message: ChatMessage):
         
         conversation = conversations[conv_id]
         
-        # Add user message to history
-        conversation["messages"].append({
-            "role": "user",
-            "content": chat_message.message
-        })
-        
         try:
             # Load ITR selection prompt
             logger.info("Loading prompt template...")
-            system_prompt = ollama_service.load_prompt_template("itr_selection")
+            system_prompt = chat_llm.load_prompt_template("itr_selection")
             user_context_str = f"""
 Income sources identified: {', '.join(conversation['user_context']['income_sources']) if conversation['user_context']['income_sources'] else 'None yet'}
 Total income: {conversation['user_context']['total_income'] or 'Not specified'}
@@ -67,15 +67,49 @@ Total income: {conversation['user_context']['total_income'] or 'Not specified'}
             # Use default prompt if template fails
             system_prompt = "You are a helpful tax assistant for Indian citizens. Help them with ITR selection and tax queries."
         
+        # Fit prior turns into the token budget (the current message is sent separately)
+        system_prompt, history = await context_builder.build(
+            conversation,
+            system_prompt,
+            llm=chat_llm
+        )
+        
+        # Add user message to history
+        conversation["messages"].append({
+            "role": "user",
+            "content": chat_message.message
+        })
+        
         try:
             # Get AI response
             logger.info("Calling Gemini API...")
-            ai_response = await ollama_service.chat(
-                user_message=chat_message.message,
-                conversation_history=conversation["messages"][-10:],
-                system_prompt=system_prompt
+            prompt_tokens = context_builder.estimate_tokens(system_prompt) + sum(
+                context_builder.message_tokens(msg) for msg in history
+            )
+            ai_response = await llm_scheduler.submit(
+                chat_message.user_id,
+                lambda: chat_llm.chat(
+                    user_message=chat_message.message,
+                    conversation_history=history,
+                    system_prompt=system_prompt,
+                    conversation_id=conv_id
+                ),
+                cost=prompt_tokens
             )
             logger.info(f"Got response from Gemini: {ai_response[:100]}...")
+        except RateLimitedError as e:
+            conversation["messages"].pop()
+            logger.warning(f"Rate limited user {chat_message.user_id}: {str(e)}")
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(max(1, round(e.retry_after)))}
+            )
+        except (PoolSaturatedError, NoHealthyBackendError) as e:
+            # Shed load quickly instead of queueing behind slow backends
+            conversation["messages"].pop()
+            logger.warning(f"Rejected chat request: {str(e)}")
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
         except Exception as e:
             logger.error(f"Error calling Gemini: {str(e)}")
             # Fallback response if LLM fails
@@ -108,6 +142,8 @@ Total income: {conversation['user_context']['total_income'] or 'Not specified'}
             message_type="text"
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
@@ -129,5 +165,6 @@ async def reset_conversation(conversation_id: str):
     """Reset a conversation"""
     if conversation_id in conversations:
         del conversations[conversation_id]
+    chat_llm.forget_conversation(conversation_id)
     
     return {"status": "success", "message": "Conversation reset"}
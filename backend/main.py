@@ -1,10 +1,15 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
+import os
 
 # Import API routes
 from api.routes import chat, itr, deductions, validation
+from services.llm_pool import llm_pool
+from services.llm_scheduler import llm_scheduler
+from services.llm_hedge import hedged_llm
 
 # Configure logging
 logging.basicConfig(
@@ -18,9 +23,26 @@ async def lifespan(app: FastAPI):
     """Lifecycle manager for startup and shutdown events"""
     logger.info("🚀 Tax Assistant API starting up...")
     # Initialize database connections, LLM clients, etc.
+    if os.getenv("OLLAMA_WARMUP", "true").lower() == "true":
+        await warmup_llm()
+    llm_pool.start()
     yield
     logger.info("👋 Tax Assistant API shutting down...")
     # Cleanup resources
+    await llm_pool.stop()
+
+async def warmup_llm():
+    """Preload the Ollama model and prime the shared ITR system prompt on every backend"""
+    try:
+        template = llm_pool.load_prompt_template("itr_selection")
+        # Everything before the per-user context is shared by all chat requests
+        shared_prefix = template.split("{user_context}")[0] if template else None
+        await asyncio.wait_for(
+            llm_pool.warmup(system_prompt=shared_prefix),
+            timeout=float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "120"))
+        )
+    except Exception as e:
+        logger.warning(f"Ollama warmup failed, first request will load the model: {str(e)}")
 
 app = FastAPI(
     title="Tax Filing Assistant API",
@@ -51,7 +73,10 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "tax-assistant-api",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "llm_pool": llm_pool.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "llm_hedge": hedged_llm.stats() if hedged_llm else None
     }
 
 @app.get("/")
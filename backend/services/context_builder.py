@@ -0,0 +1,126 @@
+import os
+from typing import Dict, List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ContextBuilder:
+    """Builds token-budgeted LLM context from conversation history"""
+
+    def __init__(self):
+        self.token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+        self.max_messages = int(os.getenv("MAX_CONVERSATION_HISTORY", "20"))
+        self.summary_max_tokens = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+        # After folding, keep the recent window at this fraction of the budget so
+        # the summary is only regenerated once the window overflows again
+        self.low_watermark = float(os.getenv("CONTEXT_LOW_WATERMARK", "0.5"))
+
+        logger.info(f"Initialized context builder with {self.token_budget} token budget")
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Approximate token count (~4 characters per token for English text)"""
+        return (len(text) + 3) // 4 if text else 0
+
+    def message_tokens(self, message: Dict[str, str]) -> int:
+        """Approximate tokens for one chat message including role overhead"""
+        return self.estimate_tokens(message.get("content", "")) + 4
+
+    async def build(
+        self,
+        conversation: Dict[str, any],
+        system_prompt: str,
+        llm=None
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Build the system prompt and recent history for the next LLM call
+
+        Args:
+            conversation: Conversation state with "messages" and an optional cached "summary"
+            system_prompt: Base system prompt for the turn
+            llm: Service with generate_with_prompt, used to regenerate the summary
+
+        Returns:
+            Tuple of (system prompt including the rolling summary, recent messages)
+        """
+        messages = conversation["messages"]
+        summary = conversation.setdefault("summary", {"text": "", "covered": 0})
+
+        window = messages[summary["covered"]:]
+        if len(window) > 1 and (
+            self._window_tokens(window) > self.token_budget or len(window) > self.max_messages
+        ):
+            cut = self._fold_point(messages, summary["covered"])
+            summary["text"] = await self._summarize(llm, summary["text"], messages[summary["covered"]:cut])
+            summary["covered"] = cut
+            window = messages[cut:]
+            logger.info(f"Folded conversation history into summary ({cut} messages covered)")
+
+        if summary["text"]:
+            system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation:\n{summary['text']}"
+
+        history = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in window
+            if msg.get("role") in ["user", "assistant"]
+        ]
+        return system_prompt, history
+
+    def _window_tokens(self, window: List[Dict[str, str]]) -> int:
+        return sum(self.message_tokens(msg) for msg in window)
+
+    def _fold_point(self, messages: List[Dict[str, str]], covered: int) -> int:
+        """Index of the first message to keep after folding older turns into the summary"""
+        target_tokens = int(self.token_budget * self.low_watermark)
+        target_messages = max(1, int(self.max_messages * self.low_watermark))
+
+        tokens = 0
+        cut = len(messages)
+        while cut > covered:
+            msg_tokens = self.message_tokens(messages[cut - 1])
+            if tokens + msg_tokens > target_tokens or len(messages) - cut >= target_messages:
+                break
+            tokens += msg_tokens
+            cut -= 1
+
+        # Fold at least one message, but always keep the latest one
+        return min(max(cut, covered + 1), len(messages) - 1)
+
+    async def _summarize(
+        self,
+        llm,
+        previous_summary: str,
+        messages: List[Dict[str, str]]
+    ) -> str:
+        """Fold messages into the rolling summary, falling back to an extractive summary"""
+        transcript = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages)
+        max_chars = self.summary_max_tokens * 4
+
+        if llm is not None:
+            try:
+                template = llm.load_prompt_template("conversation_summary")
+                if template:
+                    text = await llm.generate_with_prompt(
+                        template,
+                        {
+                            "previous_summary": previous_summary or "None",
+                            "transcript": transcript,
+                            "max_words": self.summary_max_tokens * 3 // 4
+                        }
+                    )
+                    if text.strip():
+                        return text.strip()[:max_chars]
+            except Exception as e:
+                logger.warning(f"Summary generation failed, using extractive summary: {str(e)}")
+
+        # Extractive fallback: keep the user's statements, newest last
+        lines = [previous_summary] if previous_summary else []
+        lines.extend(
+            f"- User said: {msg['content'][:200]}"
+            for msg in messages
+            if msg.get("role") == "user"
+        )
+        return "\n".join(lines)[-max_chars:]
+
+# Singleton instance
+context_builder = ContextBuilder()
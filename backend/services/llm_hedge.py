@@ -0,0 +1,209 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+import inspect
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+import logging
+
+from services.llm_pool import llm_pool
+from services.ollama_service import OllamaService
+
+logger = logging.getLogger(__name__)
+
+class HedgedLLMService:
+    """
+    Hedges LLM calls across two providers to cut tail latency
+    
+    The request goes to the primary first. If it has not answered within the
+    configured percentile of recent primary latencies, the same request is sent
+    to the backup and whichever answers first wins. The loser is cancelled after
+    an optional grace period; if it still finishes, its answer is cached under
+    the request key so an identical retry is served without another generation.
+    """
+    
+    def __init__(self, primary, backup):
+        self.primary = primary
+        self.backup = backup
+        self.percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        self.default_delay = float(os.getenv("LLM_HEDGE_DELAY", "2.0"))
+        self.min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2"))
+        self.min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.loser_grace = float(os.getenv("LLM_HEDGE_LOSER_GRACE", "0"))
+        self.cache_size = int(os.getenv("LLM_HEDGE_CACHE_SIZE", "256"))
+        self.cache_ttl = float(os.getenv("LLM_HEDGE_CACHE_TTL", "300"))
+        
+        self._latencies = deque(maxlen=500)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hedged = 0
+        self.backup_wins = 0
+        self.cache_hits = 0
+        
+        logger.info(f"Initialized hedged LLM service (p{self.percentile:g} delay)")
+    
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the primary before sending the backup request"""
+        if len(self._latencies) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+    
+    @staticmethod
+    def request_key(method: str, kwargs: Dict[str, any]) -> str:
+        """Canonical key for a request, ignoring routing-only arguments"""
+        payload = {k: v for k, v in kwargs.items() if k != "conversation_id"}
+        encoded = json.dumps([method, payload], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    
+    def _cached(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        # One-shot: a cached answer serves a single retry of the same request
+        del self._cache[key]
+        self.cache_hits += 1
+        return result
+    
+    def _store(self, key: str, result: str):
+        self._cache[key] = (time.monotonic(), result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    @staticmethod
+    def _call(service, method: str, kwargs: Dict[str, any]):
+        func = getattr(service, method)
+        if "conversation_id" in kwargs and "conversation_id" not in inspect.signature(func).parameters:
+            kwargs = {k: v for k, v in kwargs.items() if k != "conversation_id"}
+        return func(**kwargs)
+    
+    async def _hedged(self, method: str, kwargs: Dict[str, any]) -> str:
+        key = self.request_key(method, kwargs)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        
+        start = time.monotonic()
+        primary = asyncio.create_task(self._call(self.primary, method, kwargs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+            if done and primary.exception() is None:
+                self._latencies.append(time.monotonic() - start)
+                return primary.result()
+            if done:
+                logger.warning(f"Primary LLM failed, using backup: {str(primary.exception())}")
+            
+            self.hedged += 1
+            backup = asyncio.create_task(self._call(self.backup, method, kwargs))
+            tasks.append(backup)
+            pending = {primary, backup} - done
+            first_error = primary.exception() if done else None
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        first_error = first_error or task.exception()
+                        continue
+                    if task is primary:
+                        self._latencies.append(time.monotonic() - start)
+                    else:
+                        self.backup_wins += 1
+                    for loser in pending:
+                        self._settle_loser(loser, key)
+                    return task.result()
+            
+            raise first_error
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+    
+    def _settle_loser(self, task: asyncio.Task, key: str):
+        """Cancel the losing request, optionally after a grace period during which it may be cached"""
+        if self.loser_grace <= 0:
+            task.cancel()
+            return
+        
+        async def wait_and_cache():
+            try:
+                result = await asyncio.wait_for(task, timeout=self.loser_grace)
+                self._store(key, result)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            except Exception as e:
+                logger.debug(f"Hedged loser failed: {str(e)}")
+        
+        asyncio.create_task(wait_and_cache())
+    
+    async def chat(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        system_prompt: Optional[str] = None,
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """Send a chat message, hedging to the backup provider when the primary is slow"""
+        return await self._hedged("chat", {
+            "user_message": user_message,
+            "conversation_history": conversation_history,
+            "system_prompt": system_prompt,
+            "conversation_id": conversation_id
+        })
+    
+    async def generate_with_prompt(
+        self,
+        prompt_template: str,
+        variables: Dict[str, any] = None
+    ) -> str:
+        """Generate content, hedging to the backup provider when the primary is slow"""
+        return await self._hedged("generate_with_prompt", {
+            "prompt_template": prompt_template,
+            "variables": variables
+        })
+    
+    def load_prompt_template(self, template_name: str) -> str:
+        return self.primary.load_prompt_template(template_name)
+    
+    def forget_conversation(self, conversation_id: str):
+        for service in (self.primary, self.backup):
+            if hasattr(service, "forget_conversation"):
+                service.forget_conversation(conversation_id)
+    
+    def stats(self) -> Dict[str, any]:
+        return {
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "hedged": self.hedged,
+            "backup_wins": self.backup_wins,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache)
+        }
+
+def _build_hedged_service() -> Optional[HedgedLLMService]:
+    """Hedge the pool against LLM_HEDGE_BACKUP ("gemini" or an Ollama base URL)"""
+    if os.getenv("LLM_HEDGE_ENABLED", "false").lower() != "true":
+        return None
+    
+    backup_name = os.getenv("LLM_HEDGE_BACKUP", "gemini")
+    try:
+        if backup_name == "gemini":
+            from services.llm_service import gemini_service
+            backup = gemini_service
+        else:
+            backup = OllamaService(base_url=backup_name)
+    except Exception as e:
+        logger.warning(f"Hedging disabled, backup provider unavailable: {str(e)}")
+        return None
+    
+    return HedgedLLMService(llm_pool, backup)
+
+# Singleton instance (None when hedging is disabled)
+hedged_llm = _build_hedged_service()
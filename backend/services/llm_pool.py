@@ -0,0 +1,329 @@
+import os
+import time
+import asyncio
+import inspect
+from enum import Enum
+from typing import Dict, List, Optional
+import logging
+
+from services.ollama_service import OllamaService
+
+logger = logging.getLogger(__name__)
+
+class PoolSaturatedError(Exception):
+    """Raised when no backend slot frees up and the wait queue is full or times out"""
+
+class NoHealthyBackendError(Exception):
+    """Raised when every backend is unhealthy or has an open circuit"""
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial request through after a cooldown"""
+    
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+    
+    def allow_request(self) -> bool:
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = CircuitState.HALF_OPEN
+            self.trial_in_flight = False
+        return self.state == CircuitState.HALF_OPEN and not self.trial_in_flight
+    
+    def on_dispatch(self):
+        if self.state == CircuitState.HALF_OPEN:
+            self.trial_in_flight = True
+    
+    def record_success(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+class LLMBackend:
+    """One LLM service in the pool with its concurrency limit and health state"""
+    
+    def __init__(self, name: str, service, max_concurrency: int, breaker: CircuitBreaker):
+        self.name = name
+        self.service = service
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self.outstanding = 0
+        self.healthy = True
+        self.latency_ewma = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.supports_conversation_id = "conversation_id" in inspect.signature(service.chat).parameters
+    
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.outstanding < self.max_concurrency and self.breaker.allow_request()
+    
+    def load(self) -> float:
+        return self.outstanding / self.max_concurrency
+    
+    def record_latency(self, seconds: float):
+        self.latency_ewma = seconds if self.latency_ewma == 0 else 0.8 * self.latency_ewma + 0.2 * seconds
+    
+    def stats(self) -> Dict[str, any]:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state.value,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1),
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures
+        }
+
+class LLMBackendPool:
+    """
+    Routes LLM calls across several backends
+    
+    Requests go to the available backend with the fewest outstanding requests
+    (relative to its concurrency limit). When every backend is busy, callers wait
+    in a bounded queue; once it is full, requests are rejected immediately.
+    """
+    
+    def __init__(self, backends: Optional[List[LLMBackend]] = None):
+        self.max_queue = int(os.getenv("LLM_POOL_MAX_QUEUE", "32"))
+        self.queue_timeout = float(os.getenv("LLM_POOL_QUEUE_TIMEOUT", "10"))
+        self.health_interval = float(os.getenv("LLM_POOL_HEALTH_INTERVAL", "15"))
+        
+        self.backends = backends if backends is not None else self._backends_from_env()
+        self.waiting = 0
+        self.rejected = 0
+        self._slot_freed = asyncio.Condition()
+        self._health_task: Optional[asyncio.Task] = None
+        
+        logger.info(f"Initialized LLM pool with backends: {', '.join(b.name for b in self.backends)}")
+    
+    @staticmethod
+    def _backends_from_env() -> List[LLMBackend]:
+        max_concurrency = int(os.getenv("LLM_BACKEND_MAX_CONCURRENCY", "4"))
+        failure_threshold = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "3"))
+        reset_timeout = float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", "30"))
+        
+        urls = os.getenv("OLLAMA_BASE_URLS") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        backends = [
+            LLMBackend(
+                name=f"ollama:{url.strip()}",
+                service=OllamaService(base_url=url.strip()),
+                max_concurrency=max_concurrency,
+                breaker=CircuitBreaker(failure_threshold, reset_timeout)
+            )
+            for url in urls.split(",")
+            if url.strip()
+        ]
+        
+        if os.getenv("LLM_POOL_INCLUDE_GEMINI", "false").lower() == "true":
+            try:
+                from services.llm_service import gemini_service
+                backends.append(LLMBackend(
+                    name="gemini",
+                    service=gemini_service,
+                    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+                    breaker=CircuitBreaker(failure_threshold, reset_timeout)
+                ))
+            except Exception as e:
+                logger.warning(f"Gemini backend not added to pool: {str(e)}")
+        
+        return backends
+    
+    def _pick(self, conversation_id: Optional[str] = None, exclude: Optional[LLMBackend] = None) -> Optional[LLMBackend]:
+        """Least-outstanding backend, preferring one that already holds the conversation's context"""
+        candidates = [b for b in self.backends if b is not exclude and b.available]
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda b: (
+                b.load(),
+                0 if getattr(b.service, "has_context", None) and b.service.has_context(conversation_id) else 1,
+                b.latency_ewma
+            )
+        )
+    
+    async def _acquire(self, conversation_id: Optional[str] = None, exclude: Optional[LLMBackend] = None) -> LLMBackend:
+        backend = self._pick(conversation_id, exclude)
+        if backend is None:
+            if not any(b.healthy and b.breaker.state != CircuitState.OPEN for b in self.backends if b is not exclude):
+                raise NoHealthyBackendError("No healthy LLM backend available")
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise PoolSaturatedError("LLM backends are saturated, please retry shortly")
+            
+            self.waiting += 1
+            try:
+                async with self._slot_freed:
+                    await asyncio.wait_for(
+                        self._slot_freed.wait_for(lambda: self._pick(conversation_id, exclude) is not None),
+                        timeout=self.queue_timeout
+                    )
+                    backend = self._pick(conversation_id, exclude)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise PoolSaturatedError("Timed out waiting for an LLM backend")
+            finally:
+                self.waiting -= 1
+        
+        backend.outstanding += 1
+        backend.total_requests += 1
+        backend.breaker.on_dispatch()
+        return backend
+    
+    async def _release(self, backend: LLMBackend):
+        backend.outstanding -= 1
+        async with self._slot_freed:
+            self._slot_freed.notify_all()
+    
+    async def _call(self, method: str, affinity: Optional[str], **kwargs):
+        """Run a service method on the best backend, failing over once to another backend"""
+        backend = await self._acquire(affinity)
+        tried = None
+        while True:
+            start = time.monotonic()
+            try:
+                result = await getattr(backend.service, method)(**self._supported_kwargs(backend, kwargs))
+                backend.record_latency(time.monotonic() - start)
+                backend.breaker.record_success()
+                return result
+            except Exception as e:
+                backend.total_failures += 1
+                backend.breaker.record_failure()
+                logger.warning(f"LLM backend {backend.name} failed: {str(e)}")
+                if tried is not None or len(self.backends) < 2:
+                    raise
+                tried = backend
+            finally:
+                await self._release(backend)
+            
+            # Fail over to a different backend once
+            backend = await self._acquire(affinity, exclude=tried)
+    
+    @staticmethod
+    def _supported_kwargs(backend: LLMBackend, kwargs: Dict[str, any]) -> Dict[str, any]:
+        if "conversation_id" in kwargs and not backend.supports_conversation_id:
+            return {k: v for k, v in kwargs.items() if k != "conversation_id"}
+        return kwargs
+    
+    async def chat(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        system_prompt: Optional[str] = None,
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """Send a chat message through the least-loaded backend"""
+        return await self._call(
+            "chat",
+            conversation_id,
+            user_message=user_message,
+            conversation_history=conversation_history,
+            system_prompt=system_prompt,
+            conversation_id=conversation_id
+        )
+    
+    async def generate_with_prompt(
+        self,
+        prompt_template: str,
+        variables: Dict[str, any] = None
+    ) -> str:
+        """Generate content through the least-loaded backend"""
+        return await self._call(
+            "generate_with_prompt",
+            None,
+            prompt_template=prompt_template,
+            variables=variables
+        )
+    
+    def load_prompt_template(self, template_name: str) -> str:
+        return self.backends[0].service.load_prompt_template(template_name)
+    
+    def forget_conversation(self, conversation_id: str):
+        for backend in self.backends:
+            if hasattr(backend.service, "forget_conversation"):
+                backend.service.forget_conversation(conversation_id)
+    
+    async def warmup(self, system_prompt: Optional[str] = None):
+        """Warm up every backend that supports it"""
+        results = await asyncio.gather(
+            *[
+                b.service.warmup(system_prompt=system_prompt)
+                for b in self.backends
+                if hasattr(b.service, "warmup")
+            ],
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Backend warmup failed: {str(result)}")
+    
+    async def probe_health(self):
+        """Check every backend once and update its health flag"""
+        for backend in self.backends:
+            check = getattr(backend.service, "health_check", None)
+            if check is None:
+                continue
+            healthy = await check()
+            if healthy != backend.healthy:
+                logger.warning(f"LLM backend {backend.name} is now {'healthy' if healthy else 'unhealthy'}")
+            backend.healthy = healthy
+        async with self._slot_freed:
+            self._slot_freed.notify_all()
+    
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.probe_health()
+            except Exception as e:
+                logger.error(f"Health probe failed: {str(e)}")
+            await asyncio.sleep(self.health_interval)
+    
+    def start(self):
+        """Start background health probing"""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+    
+    async def stop(self):
+        """Stop health probing and close backend clients"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for backend in self.backends:
+            if hasattr(backend.service, "close"):
+                await backend.service.close()
+    
+    def stats(self) -> Dict[str, any]:
+        return {
+            "backends": [b.stats() for b in self.backends],
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected
+        }
+
+# Singleton instance
+llm_pool = LLMBackendPool()
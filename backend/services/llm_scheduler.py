@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RateLimitedError(Exception):
+    """Raised when a user exceeds their request rate or queue allowance"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Job:
+    __slots__ = ("factory", "cost", "future", "task", "enqueued_at")
+    
+    def __init__(self, factory: Callable[[], Awaitable], cost: int):
+        self.factory = factory
+        self.cost = cost
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self.enqueued_at = time.monotonic()
+
+class _UserQueue:
+    __slots__ = ("user_id", "weight", "pending", "deficit", "running", "tokens", "refilled_at", "active")
+    
+    def __init__(self, user_id: str, weight: float, burst: float):
+        self.user_id = user_id
+        self.weight = weight
+        self.pending: Deque[_Job] = deque()
+        self.deficit = 0
+        self.running = 0
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.active = False
+
+class FairScheduler:
+    """
+    Per-user fair scheduling of LLM calls
+    
+    Each user gets a FIFO queue. Queues are served with deficit round-robin,
+    where a job's cost is its estimated prompt tokens, so one user sending many
+    or very long prompts cannot starve the others. Admission is limited per user
+    by a token bucket (requests per minute with a burst allowance), a queue
+    length cap and a concurrency cap.
+    """
+    
+    def __init__(self):
+        self.capacity = int(os.getenv("LLM_SCHEDULER_CAPACITY", "8"))
+        self.quantum = int(os.getenv("LLM_SCHEDULER_QUANTUM", "512"))
+        self.user_max_concurrency = int(os.getenv("LLM_USER_MAX_CONCURRENCY", "1"))
+        self.user_max_queue = int(os.getenv("LLM_USER_MAX_QUEUE", "4"))
+        self.user_rate = float(os.getenv("LLM_USER_RATE_PER_MIN", "20")) / 60.0
+        self.user_burst = float(os.getenv("LLM_USER_BURST", "5"))
+        
+        self.running = 0
+        self.rejected = 0
+        self._users: Dict[str, _UserQueue] = {}
+        self._active: Deque[_UserQueue] = deque()
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self._submitted = 0
+        
+        logger.info(f"Initialized fair scheduler with capacity {self.capacity}")
+    
+    def _user(self, user_id: str, weight: float) -> _UserQueue:
+        self._submitted += 1
+        if self._submitted % 1000 == 0:
+            self._prune_idle()
+        queue = self._users.get(user_id)
+        if queue is None:
+            queue = self._users[user_id] = _UserQueue(user_id, weight, self.user_burst)
+        queue.weight = weight
+        return queue
+    
+    def _prune_idle(self):
+        """Forget users with nothing queued or running and a full token bucket"""
+        now = time.monotonic()
+        refill_time = self.user_burst / self.user_rate if self.user_rate > 0 else float("inf")
+        for user_id, queue in list(self._users.items()):
+            if not queue.active and queue.running == 0 and now - queue.refilled_at >= refill_time:
+                del self._users[user_id]
+    
+    def _take_token(self, queue: _UserQueue):
+        now = time.monotonic()
+        queue.tokens = min(self.user_burst, queue.tokens + (now - queue.refilled_at) * self.user_rate)
+        queue.refilled_at = now
+        if queue.tokens < 1:
+            self.rejected += 1
+            raise RateLimitedError(
+                "Too many messages, please slow down",
+                retry_after=(1 - queue.tokens) / self.user_rate if self.user_rate > 0 else 60.0
+            )
+        queue.tokens -= 1
+    
+    async def submit(
+        self,
+        user_id: str,
+        factory: Callable[[], Awaitable],
+        cost: int = 1,
+        weight: float = 1.0
+    ):
+        """
+        Queue an LLM call for a user and wait for its result
+        
+        Args:
+            user_id: Owner of the request, used as the fairness key
+            factory: Zero-argument callable returning the awaitable to run
+            cost: Estimated prompt tokens, charged against the user's deficit
+            weight: Relative share of capacity for this user
+        
+        Returns:
+            The result of the awaited call
+        """
+        queue = self._user(user_id, weight)
+        if len(queue.pending) >= self.user_max_queue:
+            self.rejected += 1
+            raise RateLimitedError("Too many pending messages, please wait for a reply", retry_after=5.0)
+        self._take_token(queue)
+        
+        job = _Job(factory, max(1, cost))
+        queue.pending.append(job)
+        if not queue.active:
+            queue.active = True
+            self._active.append(queue)
+        self._dispatch()
+        
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # Caller went away: drop the queued job or stop the running call
+            if job.task is not None:
+                job.task.cancel()
+            elif job in queue.pending:
+                queue.pending.remove(job)
+            raise
+    
+    def _dispatch(self):
+        """Start queued jobs in deficit round-robin order while capacity allows"""
+        while self.running < self.capacity and self._active:
+            started = False
+            for _ in range(len(self._active)):
+                queue = self._active[0]
+                self._active.rotate(-1)
+                
+                if not queue.pending:
+                    self._active.remove(queue)
+                    queue.active = False
+                    queue.deficit = 0
+                    continue
+                if queue.running >= self.user_max_concurrency:
+                    continue
+                
+                queue.deficit += int(self.quantum * queue.weight)
+                if queue.deficit >= queue.pending[0].cost:
+                    job = queue.pending.popleft()
+                    queue.deficit -= job.cost
+                    self._start(queue, job)
+                    started = True
+                    if self.running >= self.capacity:
+                        return
+            if not started and not any(
+                q.pending and q.running < self.user_max_concurrency for q in self._active
+            ):
+                return
+    
+    def _start(self, queue: _UserQueue, job: _Job):
+        self.running += 1
+        queue.running += 1
+        self._waits.append(time.monotonic() - job.enqueued_at)
+        job.task = asyncio.create_task(self._run(queue, job))
+    
+    async def _run(self, queue: _UserQueue, job: _Job):
+        try:
+            result = await job.factory()
+            if not job.future.done():
+                job.future.set_result(result)
+        except asyncio.CancelledError:
+            if not job.future.done():
+                job.future.cancel()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self.running -= 1
+            queue.running -= 1
+            self._dispatch()
+    
+    def stats(self) -> Dict[str, any]:
+        waits = sorted(self._waits)
+        return {
+            "running": self.running,
+            "capacity": self.capacity,
+            "queued": sum(len(q.pending) for q in self._active),
+            "active_users": len(self._active),
+            "rejected": self.rejected,
+            "queue_depth_by_user": {q.user_id: len(q.pending) for q in self._active if q.pending},
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 1) if waits else 0.0
+            }
+        }
+
+# Singleton instance
+llm_scheduler = FairScheduler()
@@ -1,27 +1,93 @@
 import os
 import httpx
-from typing import List, Dict, Optional
+import hashlib
+from collections import OrderedDict
+from typing import AsyncIterator, List, Dict, Optional
 import logging
 import json
 
+from services.singleflight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 class OllamaService:
     """Service for interacting with local Ollama API"""
     
-    def __init__(self):
-        self.base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self.model_name = os.getenv("OLLAMA_MODEL", "llama3.2")
         self.temperature = float(os.getenv("LLM_TEMPERATURE", "0.3"))
         self.max_tokens = int(os.getenv("LLM_MAX_TOKENS", "2000"))
         
-        logger.info(f"Initialized Ollama service with model: {self.model_name}")
+        # How long Ollama keeps the model loaded after a request ("30m", "-1" = forever)
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        
+        # Per-conversation reuse of the /api/generate context tokens
+        self.context_reuse = os.getenv("OLLAMA_CONTEXT_REUSE", "true").lower() == "true"
+        self.context_cache_size = int(os.getenv("OLLAMA_CONTEXT_CACHE_SIZE", "256"))
+        self.max_context_tokens = int(os.getenv("OLLAMA_MAX_CONTEXT_TOKENS", "4096"))
+        self._contexts: "OrderedDict[str, Dict[str, any]]" = OrderedDict()
+        
+        self._http: Optional[httpx.AsyncClient] = None
+        
+        # Identical concurrent requests share one generation
+        self._inflight = SingleFlight()
+        
+        logger.info(f"Initialized Ollama service with model: {self.model_name} at {self.base_url}")
+    
+    def _client(self) -> httpx.AsyncClient:
+        """Shared HTTP client so connections to Ollama are reused across requests"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(base_url=self.base_url, timeout=60.0)
+        return self._http
+    
+    async def close(self):
+        """Close the shared HTTP client"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    def _options(self) -> Dict[str, any]:
+        return {
+            "temperature": self.temperature,
+            "num_predict": self.max_tokens
+        }
+    
+    @staticmethod
+    def _request_key(path: str, payload: Dict[str, any]) -> str:
+        """Canonical key for coalescing identical requests"""
+        encoded = json.dumps([path, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    
+    async def _post(self, path: str, payload: Dict[str, any]) -> Dict[str, any]:
+        """POST to Ollama, sharing one in-flight request among identical concurrent callers"""
+        return await self._inflight.do(
+            self._request_key(path, payload),
+            lambda: self._send(path, payload)
+        )
+    
+    async def _send(self, path: str, payload: Dict[str, any]) -> Dict[str, any]:
+        response = await self._client().post(path, json=payload)
+        if response.status_code != 200:
+            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+            raise Exception(f"Ollama API returned status {response.status_code}")
+        return response.json()
+    
+    @staticmethod
+    def _fingerprint(system_prompt: Optional[str], messages: List[Dict[str, str]]) -> str:
+        """Hash of the prompt prefix that a stored context represents"""
+        payload = json.dumps(
+            [system_prompt or "", [(m.get("role"), m.get("content")) for m in messages]],
+            ensure_ascii=False
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
     
     async def chat(
         self,
         user_message: str,
         conversation_history: List[Dict[str, str]] = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        conversation_id: Optional[str] = None
     ) -> str:
         """
         Send a chat message to Ollama and get response
@@ -30,58 +96,32 @@ class OllamaService:
             user_message: The user's message
             conversation_history: List of previous messages
             system_prompt: Optional system prompt to set context
+            conversation_id: Optional conversation key for reusing evaluated context
         
         Returns:
             The assistant's response
         """
         try:
-            messages = []
-            
-            # Add system prompt if provided
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
-            
-            # Add conversation history
-            if conversation_history:
-                for msg in conversation_history[-10:]:
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    if role in ["user", "assistant"]:
-                        messages.append({
-                            "role": role,
-                            "content": content
-                        })
-            
-            # Add current user message
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
+            if conversation_id and self.context_reuse:
+                return await self._chat_with_context(
+                    conversation_id,
+                    user_message,
+                    conversation_history or [],
+                    system_prompt
+                )
             
             # Make request to Ollama API
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "stream": False,
-                        "options": {
-                            "temperature": self.temperature,
-                            "num_predict": self.max_tokens
-                        }
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("message", {}).get("content", "I couldn't generate a response.")
-                else:
-                    logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                    raise Exception(f"Ollama API returned status {response.status_code}")
+            result = await self._post(
+                "/api/chat",
+                {
+                    "model": self.model_name,
+                    "messages": self._build_messages(user_message, conversation_history, system_prompt),
+                    "stream": False,
+                    "keep_alive": self.keep_alive,
+                    "options": self._options()
+                }
+            )
+            return result.get("message", {}).get("content", "I couldn't generate a response.")
         
         except httpx.ConnectError:
             logger.error("Cannot connect to Ollama. Make sure Ollama is running (ollama serve)")
@@ -90,6 +130,204 @@ class OllamaService:
             logger.error(f"Error in Ollama chat: {str(e)}")
             raise
     
+    @staticmethod
+    def _build_messages(
+        user_message: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        system_prompt: Optional[str]
+    ) -> List[Dict[str, str]]:
+        messages = []
+        
+        # Add system prompt if provided
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        # Add conversation history (already trimmed to the context budget by the caller)
+        if conversation_history:
+            for msg in conversation_history:
+                role = msg.get("role", "user")
+                content = msg.get("content", "")
+                if role in ["user", "assistant"]:
+                    messages.append({
+                        "role": role,
+                        "content": content
+                    })
+        
+        # Add current user message
+        messages.append({
+            "role": "user",
+            "content": user_message
+        })
+        return messages
+    
+    async def stream_chat(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream chat response for real-time display
+        
+        Identical concurrent streams share one generation whose chunks are fanned
+        out to every caller.
+        
+        Yields:
+            Chunks of the response as they're generated
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": self._build_messages(user_message, conversation_history, system_prompt),
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": self._options()
+        }
+        try:
+            async for chunk in self._inflight.stream(
+                self._request_key("/api/chat", payload),
+                lambda: self._stream("/api/chat", payload)
+            ):
+                yield chunk
+        except httpx.ConnectError:
+            logger.error("Cannot connect to Ollama. Make sure Ollama is running (ollama serve)")
+            raise Exception("Ollama is not running. Please start it with 'ollama serve'")
+    
+    async def _stream(self, path: str, payload: Dict[str, any]) -> AsyncIterator[str]:
+        async with self._client().stream("POST", path, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+                raise Exception(f"Ollama API returned status {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                content = data.get("message", {}).get("content") or data.get("response")
+                if content:
+                    yield content
+                if data.get("done"):
+                    break
+    
+    async def _chat_with_context(
+        self,
+        conversation_id: str,
+        user_message: str,
+        conversation_history: List[Dict[str, str]],
+        system_prompt: Optional[str]
+    ) -> str:
+        """
+        Chat through /api/generate, reusing the context tokens of the previous turn
+        
+        The stored context is only reused when the system prompt and history are
+        exactly what the model saw last turn; otherwise the full prefix is sent.
+        """
+        history = [m for m in conversation_history if m.get("role") in ["user", "assistant"]]
+        cached = self._contexts.get(conversation_id)
+        
+        payload = {
+            "model": self.model_name,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": self._options()
+        }
+        
+        if cached and cached["fingerprint"] == self._fingerprint(system_prompt, history):
+            # Only the new message needs to be evaluated
+            payload["prompt"] = user_message
+            payload["context"] = cached["context"]
+            self._contexts.move_to_end(conversation_id)
+        else:
+            transcript = "\n".join(
+                f"{m['role'].capitalize()}: {m['content']}" for m in history
+            )
+            payload["prompt"] = f"{transcript}\nUser: {user_message}" if transcript else user_message
+            if system_prompt:
+                payload["system"] = system_prompt
+        
+        try:
+            result = await self._post("/api/generate", payload)
+        except Exception:
+            self._contexts.pop(conversation_id, None)
+            raise
+        
+        answer = result.get("response") or "I couldn't generate a response."
+        
+        context = result.get("context")
+        if context and len(context) <= self.max_context_tokens:
+            self._contexts[conversation_id] = {
+                "fingerprint": self._fingerprint(
+                    system_prompt,
+                    history + [
+                        {"role": "user", "content": user_message},
+                        {"role": "assistant", "content": answer}
+                    ]
+                ),
+                "context": context
+            }
+            self._contexts.move_to_end(conversation_id)
+            while len(self._contexts) > self.context_cache_size:
+                self._contexts.popitem(last=False)
+        else:
+            self._contexts.pop(conversation_id, None)
+        
+        return answer
+    
+    def forget_conversation(self, conversation_id: str):
+        """Drop any stored context for a conversation"""
+        self._contexts.pop(conversation_id, None)
+    
+    def has_context(self, conversation_id: Optional[str]) -> bool:
+        """Whether this instance holds reusable context for a conversation"""
+        return conversation_id is not None and conversation_id in self._contexts
+    
+    async def health_check(self) -> bool:
+        """Check that the Ollama server is reachable"""
+        try:
+            response = await self._client().get("/api/tags", timeout=5.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+    
+    async def warmup(self, system_prompt: Optional[str] = None):
+        """
+        Load the model into memory and prime the shared system prompt
+        
+        Args:
+            system_prompt: Prompt prefix shared by most requests, evaluated once so
+                Ollama can reuse its cached prefix for the first real request
+        """
+        client = self._client()
+        
+        # An empty prompt only loads the model
+        response = await client.post(
+            "/api/generate",
+            json={"model": self.model_name, "keep_alive": self.keep_alive},
+            timeout=None
+        )
+        if response.status_code != 200:
+            raise Exception(f"Ollama API returned status {response.status_code}")
+        
+        if system_prompt:
+            response = await client.post(
+                "/api/generate",
+                json={
+                    "model": self.model_name,
+                    "system": system_prompt,
+                    "prompt": "Hello",
+                    "stream": False,
+                    "keep_alive": self.keep_alive,
+                    "options": {"temperature": self.temperature, "num_predict": 1}
+                },
+                timeout=None
+            )
+            if response.status_code != 200:
+                raise Exception(f"Ollama API returned status {response.status_code}")
+        
+        logger.info(f"Ollama model {self.model_name} warmed up")
+    
     async def generate_with_prompt(
         self,
         prompt_template: str,
@@ -102,25 +340,17 @@ class OllamaService:
             else:
                 prompt = prompt_template
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": self.model_name,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": self.temperature,
-                            "num_predict": self.max_tokens
-                        }
-                    }
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("response", "")
-                else:
-                    raise Exception(f"Ollama API returned status {response.status_code}")
+            result = await self._post(
+                "/api/generate",
+                {
+                    "model": self.model_name,
+                    "prompt": prompt,
+                    "stream": False,
+                    "keep_alive": self.keep_alive,
+                    "options": self._options()
+                }
+            )
+            return result.get("response", "")
         
         except Exception as e:
             logger.error(f"Error generating content: {str(e)}")
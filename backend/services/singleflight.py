@@ -0,0 +1,130 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    __slots__ = ("task", "waiters")
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _StreamCall:
+    __slots__ = ("task", "waiters", "chunks", "finished", "error", "updated")
+    
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.updated = asyncio.Event()
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one in-flight execution
+    
+    Callers with the same key share the first caller's task and all receive its
+    result or exception. The shared call is only cancelled once every waiter has
+    gone away. Streams are fanned out: each waiter replays the chunks produced so
+    far and then follows the live stream.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamCall] = {}
+        self.coalesced = 0
+    
+    def _forget(self, table: Dict[str, any], key: str, call):
+        if table.get(key) is call:
+            del table[key]
+    
+    async def do(self, key: str, factory: Callable[[], Awaitable]):
+        """
+        Run factory() once for all concurrent callers with the same key
+        
+        Args:
+            key: Canonical request key
+            factory: Zero-argument callable returning the awaitable to run
+        
+        Returns:
+            The shared result
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+        else:
+            self.coalesced += 1
+        
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Last interested caller left: stop the work and let new callers start afresh
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+    
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Stream factory()'s chunks once and fan them out to every concurrent caller
+        
+        Args:
+            key: Canonical request key
+            factory: Zero-argument callable returning an async iterator of chunks
+        
+        Yields:
+            Chunks of the shared stream, starting from the first one
+        """
+        call = self._streams.get(key)
+        if call is None:
+            call = _StreamCall()
+            self._streams[key] = call
+            call.task = asyncio.create_task(self._pump(key, call, factory))
+        else:
+            self.coalesced += 1
+        
+        call.waiters += 1
+        position = 0
+        try:
+            while True:
+                while position < len(call.chunks):
+                    yield call.chunks[position]
+                    position += 1
+                if call.finished:
+                    if call.error is not None:
+                        raise call.error
+                    return
+                call.updated.clear()
+                await call.updated.wait()
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.finished:
+                self._forget(self._streams, key, call)
+                call.task.cancel()
+    
+    async def _pump(self, key: str, call: _StreamCall, factory: Callable[[], AsyncIterator[str]]):
+        try:
+            async for chunk in factory():
+                call.chunks.append(chunk)
+                call.updated.set()
+        except asyncio.CancelledError:
+            call.error = asyncio.CancelledError()
+        except Exception as e:
+            call.error = e
+        finally:
+            call.finished = True
+            call.updated.set()
+            self._forget(self._streams, key, call)
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams),
+            "coalesced": self.coalesced
+        }